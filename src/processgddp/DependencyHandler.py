@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import os
-from .Worker import worker
+from .Worker import worker, multiWorker
 from .TaskTree import TaskTree
 from functools import partial
 
@@ -166,7 +166,7 @@ def getParams(key):
 def listFormulae():
     return _Formulae.keys()
 
-def dependencyTree(keys, client, skipExisting=False, poolargs={}):
+def dependencyTree(keys, client, skipExisting=False, poolargs={}, fuse=False):
     '''yeilds depth-first unique dependencies for a given set of task keys'''
     tree = TaskTree(**poolargs)
     if type(keys) is str:
@@ -176,8 +176,27 @@ def dependencyTree(keys, client, skipExisting=False, poolargs={}):
         if not tree.exists(key):
             _addDependencies(tree, key, client, skipExisting)
     tree.skip_undefined()
+    if fuse:
+        fuseSources(tree)
     return tree
 
+def fuseSources(tree):
+    '''
+    Merge tasks that read the same source data with the same inputs into a
+    single task that reads the inputs once and computes all of their outputs
+    '''
+    groups = {}
+    for key, requires in tree.get_requirements().items():
+        if any(_isSource(r) for r in requires):
+            groups.setdefault(tuple(requires), []).append(key)
+    for keys in groups.values():
+        if len(keys) > 1:
+            functions = [getFormula(k).function for k in keys]
+            tree.merge(keys, partial(multiWorker, functions=functions))
+
+def _isSource(key):
+    return key[:4] in ('http', 'ftp:')
+
 def _addDependencies(tree, key, client, skipExisting=False):
     if skipExisting and client.objExists2(key):
         tree.skip_task(key)
@@ -187,7 +206,7 @@ def _addDependencies(tree, key, client, skipExisting=False):
     tree.add(formula.getFunction(), key, requires)
     for k in requires:
         if not tree.exists(k):
-            if k[:4] != 'http':
+            if not _isSource(k):
                 _addDependencies(tree, k, client, skipExisting)
             else:
                 tree.skip_task(k)
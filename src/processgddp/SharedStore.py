@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import os
+import pickle
+import logging
+import numpy as np
+
+EXT = '.npy'
+
+class SharedStore:
+    def __init__(self, root):
+        '''
+        Node-local store of computed arrays, keyed by task key.
+
+        Arrays are saved as uncompressed .npy files so that consumers on the
+        same node can memory-map them instead of downloading and decoding
+        the GeoTIFF copy from S3. Entries are written atomically; the array
+        file only appears once its profile has been saved.
+        '''
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key + EXT)
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def put(self, key, arr, profile):
+        fname = self.path(key)
+        tmpname = '{}.{}.tmp'.format(fname, os.getpid())
+        with open(_profileName(fname), 'wb') as f:
+            pickle.dump(dict(profile), f)
+        with open(tmpname, 'wb') as f:
+            np.save(f, arr)
+        os.rename(tmpname, fname)
+        logging.debug('Shared {}'.format(key))
+        return fname
+
+    def get(self, key):
+        return load(self.path(key))
+
+    def remove(self, key):
+        fname = self.path(key)
+        for f in (fname, _profileName(fname)):
+            try:
+                os.remove(f)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for f in os.listdir(self.root):
+            os.remove(os.path.join(self.root, f))
+
+def _profileName(fname):
+    return os.path.splitext(fname)[0] + '.profile'
+
+def load(fname):
+    '''returns a read-only memory map of a stored array and its profile'''
+    with open(_profileName(fname), 'rb') as f:
+        profile = pickle.load(f)
+    return np.load(fname, mmap_mode='r'), profile
+
+def isShared(fname):
+    return os.path.splitext(fname)[-1] == EXT
@@ -20,8 +20,14 @@ class TaskTree:
         self._taskBlockedby = {}
         self._taskBlocks = {}
         self._dummyTasks = []
+        self._taskMembers = {}
+        self._mergedInto = {}
+        self._consumersLeft = {}
         self.results = {}
         self.timeout = timeout
+        # Optional function called with each taskId whose result is no longer
+        # required by any task that has not yet completed
+        self.on_release = None
         self.poolargs = poolargs
 
     def __len__(self):
@@ -48,10 +54,10 @@ class TaskTree:
 
         self._taskFunction[taskId] = function
         self._taskRequirements[taskId] = requires
-        self._taskBlockedby[taskId] = requires[:]
-        if len(requires):
+        self._taskBlockedby[taskId] = [r for r in requires if r not in self.results]
+        if len(self._taskBlockedby[taskId]):
             self._blocked.append(taskId)
-            for r in requires:
+            for r in self._taskBlockedby[taskId]:
                 if r in self._taskBlocks and type(self._taskBlocks[r]) is list:
                     self._taskBlocks[r].append(taskId)
                 else:
@@ -60,7 +66,46 @@ class TaskTree:
             self._unblocked.append(taskId)
 
     def exists(self, taskId):
-        return taskId in self._taskRequirements
+        return taskId in self._taskRequirements or taskId in self._mergedInto
+
+    def merge(self, taskIds, function, mergedId=None):
+        '''
+        Replace several tasks with a single task that completes all of them
+
+        @params
+        list<string> taskIds    Tasks to merge.
+        function     function   Function to be executed in place of the
+                                merged tasks' functions. Receives <mergedId>
+                                and the return values of the union of their
+                                requirements, and must return a list of
+                                return values, one for each of <taskIds>.
+        string       mergedId   Task name of the merged task.
+                                Defaults to the tuple of <taskIds>.
+        '''
+        taskIds = list(taskIds)
+        if mergedId is None:
+            mergedId = tuple(taskIds)
+        requires = []
+        for taskId in taskIds:
+            for r in self._taskRequirements[taskId]:
+                if r not in requires:
+                    requires.append(r)
+            self._remove(taskId)
+            self._mergedInto[taskId] = mergedId
+        self.add(function, mergedId, requires)
+        self._taskMembers[mergedId] = taskIds
+        return mergedId
+
+    def _remove(self, taskId):
+        '''remove a task that has not been started, keeping tasks it blocks'''
+        if taskId in self._blocked:
+            self._blocked.remove(taskId)
+        else:
+            self._unblocked.remove(taskId)
+        for r in self._taskBlockedby.pop(taskId):
+            self._taskBlocks[r].remove(taskId)
+        del self._taskFunction[taskId]
+        del self._taskRequirements[taskId]
 
     def build(self, *args, **kwargs):
         '''
@@ -123,13 +168,14 @@ class TaskTree:
                 raise Exception("Tasks cannot be unblocked: {}".format(
                     self._blocked))
         pool.close()
+        pool.join()
         return self.results
 
     def get_undefined_tasks(self):
         '''return required taskIds that are undefined'''
         undefined = []
         for b in self._taskBlocks.keys():
-            if b not in self._taskFunction and b not in self.results:
+            if b not in self._taskFunction and b not in self.results and b not in self._mergedInto:
                 undefined.append(b)
         return undefined
 
@@ -148,6 +194,7 @@ class TaskTree:
         self._unblocked = []
         self._completed = []
         self._inprocess = []
+        self._consumersLeft = {}
         for taskId, requires in self._taskRequirements.items():
             self._taskBlockedby[taskId] = requires[:]
             if len(requires):
@@ -165,14 +212,33 @@ class TaskTree:
     def _complete(self, taskId):
         '''unblock dependent tasks'''
         self._inprocess.remove(taskId)
+        self._unblock(taskId)
+        for member, result in zip(self._taskMembers.get(taskId, []), self.results[taskId]):
+            self.results[member] = result
+            self._unblock(member)
+        if self.on_release is not None:
+            self._release(taskId)
+        self._completed.append(taskId)
+        logging.info('Completed {}'.format(taskId))
+
+    def _release(self, taskId):
+        '''release outputs without consumers and requirements whose consumers are all complete'''
+        for t in self._taskMembers.get(taskId, [taskId]):
+            if not self._taskBlocks.get(t):
+                self.on_release(t)
+        for r in self._taskRequirements[taskId]:
+            left = self._consumersLeft.get(r, len(self._taskBlocks.get(r, []))) - 1
+            self._consumersLeft[r] = left
+            if left == 0:
+                self.on_release(r)
+
+    def _unblock(self, taskId):
         if taskId in self._taskBlocks:
             for b in self._taskBlocks[taskId]:
                 self._taskBlockedby[b].remove(taskId)
                 if len(self._taskBlockedby[b]) < 1:
                     self._blocked.remove(b)
                     self._unblocked.append(b)
-        self._completed.append(taskId)
-        logging.info('Completed {}'.format(taskId))
 
     def skip_undefined(self):
         for t in self.get_undefined_tasks():
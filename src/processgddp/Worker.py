@@ -1,14 +1,22 @@
 import os
 import numpy as np
 import rasterio as rio
+from rasterio.windows import Window
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
+
 from . import FileHandler
 from . import DependencyHandler
+from . import SharedStore
 from .formulae import FUNCTIONS
 
 NOCACHE = False
 STRICT = True
+TILESIZE = 0
+SHAREDSTORE = False
+
+_uploader = None
 
 def worker(yields, requires, function=None, options={}, dryrun=False):
     if dryrun:
@@ -16,39 +24,178 @@ def worker(yields, requires, function=None, options={}, dryrun=False):
         return yields
     if function is None:
         raise Exception('Function not defined')
+    return multiWorker([yields], requires, [function], options)[0]
+
+def multiWorker(yields, requires, functions=None, options={}, dryrun=False):
+    '''
+    Compute several outputs from a single read of the shared inputs
+
+    yields      list of output keys
+    requires    list of input keys stacked on axis 0
+    functions   list of function names defined in formulae.FUNCTIONS, one per output key
+    '''
+    if dryrun:
+        print(yields, requires)
+        return list(yields)
+    if functions is None:
+        raise Exception('Function not defined')
     nocache = options.get('nocache', NOCACHE)
-    dataset = DependencyHandler.parseKey(yields)['d']
+    tilesize = options.get('tilesize', TILESIZE)
+    dataset = DependencyHandler.parseKey(yields[0])['d']
     client = FileHandler.Client(**options)
+    store = getStore(options)
+    fnames = [client.cached(y) for y in yields]
+    kernels = [FUNCTIONS[f] for f in functions]
 
-    arr, profile = getData(requires, client, dataset, nocache)
+    infiles, downloaded = getFiles(requires, client, nocache, store)
+    try:
+        if tilesize:
+            logging.debug('Processing {} in tiles of {} rows'.format(', '.join(yields), tilesize))
+            writeTiled(infiles, fnames, dataset, kernels, tilesize)
+        else:
+            arr, profile = getWindow(infiles, dataset)
+    finally:
+        if nocache:
+            client.cleanObjs(downloaded)
 
-    logging.debug('Processing {}'.format(yields))
-    arr = FUNCTIONS[function](arr)
+    if tilesize:
+        for y, fname in zip(yields, fnames):
+            _put(client, fname, y, nocache)
+        return list(yields)
 
-    fname = client.cached(yields)
-    write(arr, fname, profile)
-    client.putObj(fname, yields)
+    for y, fname, kernel in zip(yields, fnames, kernels):
+        logging.debug('Processing {}'.format(y))
+        out = kernel(arr)
+        if store is None:
+            write(out, fname, profile.copy())
+            _put(client, fname, y, nocache)
+        else:
+            # Publish for consumers on this node and upload in the background
+            out = out.astype(profile['dtype'])
+            store.put(y, out, _outProfile(out, profile))
+            _background(_writeAndPut, client, out, fname, profile.copy(), y, nocache)
 
-    if nocache:
-        client.cleanObjs(fname)
+    return list(yields)
 
-    return yields
+def getStore(options):
+    '''returns the node-local SharedStore if enabled in `options`'''
+    if not options.get('sharedstore', SHAREDSTORE):
+        return None
+    cachedir = options.get('cachedir', '_cache')
+    return SharedStore.SharedStore(os.path.join(cachedir, '_shared'))
 
-def getData(requires, client, dataset, nocache=NOCACHE):
-    arr = None
+def getFiles(requires, client, nocache=NOCACHE, store=None):
+    '''
+    Returns local filenames for `requires`, preferring arrays published to
+    `store`, and the subset of filenames that were downloaded.
+    '''
     if type(requires) not in (list, tuple):
         requires = [requires]
+    infiles = []
+    downloaded = []
     for r in requires:
-        fname = client.getObj(r, nocache=nocache)
-        if arr is None:
-            arr, profile = read(fname, dataset)
+        if store is not None and store.exists(r):
+            infiles.append(store.path(r))
         else:
-            arr2, _ = read(fname, dataset)
-            arr = np.concatenate((arr, arr2), axis=0)
+            fname = client.getObj(r, nocache=nocache)
+            infiles.append(fname)
+            downloaded.append(fname)
+    return infiles, downloaded
+
+def getData(requires, client, dataset, nocache=NOCACHE, store=None):
+    infiles, downloaded = getFiles(requires, client, nocache, store)
+    try:
+        return getWindow(infiles, dataset)
+    finally:
         if nocache:
-            client.cleanObjs(fname)
+            client.cleanObjs(downloaded)
+
+def _put(client, fname, obj, nocache=NOCACHE):
+    client.putObj(fname, obj)
+    if nocache:
+        client.cleanObjs(fname)
+
+def _writeAndPut(client, arr, fname, profile, obj, nocache=NOCACHE):
+    try:
+        write(arr, fname, profile)
+        _put(client, fname, obj, nocache)
+    except Exception as e:
+        logging.error('Background upload of {} failed: {}'.format(obj, e))
+
+def _background(func, *args):
+    '''run `func` in this process's upload thread, which is joined at exit'''
+    global _uploader
+    if _uploader is None:
+        _uploader = ThreadPoolExecutor(max_workers=1)
+    return _uploader.submit(func, *args)
+
+def _outProfile(arr, profile):
+    profile = profile.copy()
+    profile["driver"] = "GTiff"
+    profile["count"] = arr.shape[0]
+    return profile
+
+def getWindow(infiles, dataset, window=None):
+    '''
+    Stack `infiles` on axis 0, reading each directly into its slice of a
+    single preallocated array.
+    '''
+    counts = []
+    dtypes = []
+    for fname in infiles:
+        count, dtype, h, w = _header(fname)
+        counts.append(count)
+        dtypes.append(dtype)
+    if window is not None:
+        h, w = int(window.height), int(window.width)
+    arr = np.empty((sum(counts), h, w), dtype=np.result_type(*dtypes))
+    band = 0
+    for fname, count in zip(infiles, counts):
+        _, p = read(fname, dataset, window, out=arr[band:band+count])
+        if band == 0:
+            profile = p
+        band += count
     return arr, profile
 
+def _tiles(height, width, tilesize):
+    '''yields full-width row windows of at most `tilesize` rows'''
+    for row in range(0, height, tilesize):
+        yield Window(0, row, width, min(tilesize, height - row))
+
+def writeTiled(infiles, outfiles, dataset, functions, tilesize):
+    '''
+    Apply each of `functions` to the stack of `infiles` one tile at a time,
+    writing each result tile into the matching file in `outfiles`.
+
+    Tiles span the full width of the grid so that kernels and the NEX-GDDP
+    x-axis roll see complete rows.
+    '''
+    _, _, height, width = _header(infiles[0])
+    dsts = [None for f in outfiles]
+    try:
+        for window in _tiles(height, width, tilesize):
+            arr, profile = getWindow(infiles, dataset, window)
+            for i, (outfile, function) in enumerate(zip(outfiles, functions)):
+                out = function(arr)
+                if dsts[i] is None:
+                    profile = profile.copy()
+                    profile["driver"] = "GTiff"
+                    profile["count"] = out.shape[0]
+                    dsts[i] = rio.open(outfile, 'w', **profile)
+                dsts[i].write(out.astype(dsts[i].dtypes[0]), window=window)
+    except (SystemExit, KeyboardInterrupt):
+        for i, outfile in enumerate(outfiles):
+            logging.debug('Exiting gracefully {}'.format(outfile))
+            if dsts[i] is not None:
+                dsts[i].close()
+                dsts[i] = None
+                os.remove(outfile)
+    finally:
+        for dst in dsts:
+            if dst is not None:
+                dst.close()
+    return outfiles
+
 def _writeTiff(arr, outfile, profile):
     profile["driver"] = "GTiff"
     profile["count"] = arr.shape[0]
@@ -63,38 +210,75 @@ def _writeTiff(arr, outfile, profile):
 def write(arr, outfile, profile):
     return _writeTiff(arr, outfile, profile)
 
-def _readNC(infile, dataset):
+def _readNC(infile, dataset, window=None, out=None):
     with rio.open(infile) as src:
-        arr = src.read()
         profile = src.profile
-        # No Data
-        if 'nodata' in profile:
-            arr[arr==profile['nodata']] = np.nan
 
         # Reshape NEXGDDP raster
         if dataset == DependencyHandler.NEXGDDP:
-            _,h,w = arr.shape
+            h, w = src.height, src.width
             # Roll x-axis for 180W origin
-            arr = np.roll(arr, int(w/2), axis=2)
+            arr = _readRolled(src, int(w/2), window, out)
             # Set scale to .25 and origin to 90S,180W
             profile.update({
                 "transform":rio.Affine(360.0/w,0,-180,0,-180.0/h,90),
                 "crs":"EPSG:4326"
             })
-        elif dataset == DependencyHandler.LOCA:
-            profile.update({'crs':"EPSG:4326"})
+        else:
+            arr = src.read(window=window, out=out)
+            if dataset == DependencyHandler.LOCA:
+                profile.update({'crs':"EPSG:4326"})
+
+        # No Data
+        if 'nodata' in profile:
+            arr[arr==profile['nodata']] = np.nan
         return arr, profile
 
-def _readTiff(infile):
+def _readRolled(src, shift, window=None, out=None):
+    '''read full-width rows with the x-axis rolled by `shift` columns'''
+    w = src.width
+    if window is None:
+        window = Window(0, 0, w, src.height)
+    if out is None:
+        out = np.empty((src.count, int(window.height), w), dtype=src.dtypes[0])
+    row, height = window.row_off, window.height
+    src.read(window=Window(0, row, w-shift, height), out=out[..., shift:])
+    src.read(window=Window(w-shift, row, shift, height), out=out[..., :shift])
+    return out
+
+def _readTiff(infile, window=None, out=None):
     with rio.open(infile) as src:
-        arr = src.read()
+        arr = src.read(window=window, out=out)
         profile = src.profile
         if 'nodata' in profile:
             arr[arr==profile['nodata']] = np.nan
         return arr, profile
 
-def read(infile, dataset):
-    if os.path.splitext(infile)[-1] == '.nc':
-        return _readNC(infile, dataset)
+def _readShared(infile, window=None, out=None):
+    arr, profile = SharedStore.load(infile)
+    if window is not None:
+        rows, cols = window.toslices()
+        arr = arr[:, rows, cols]
+    if out is None:
+        out = np.empty(arr.shape, dtype=arr.dtype)
+    out[:] = arr
+    if 'nodata' in profile:
+        out[out==profile['nodata']] = np.nan
+    return out, profile
+
+def _header(infile):
+    '''returns band count, dtype, height and width of `infile`'''
+    if SharedStore.isShared(infile):
+        arr, _ = SharedStore.load(infile)
+        count, h, w = arr.shape
+        return count, arr.dtype, h, w
+    with rio.open(infile) as src:
+        return src.count, src.dtypes[0], src.height, src.width
+
+def read(infile, dataset, window=None, out=None):
+    if SharedStore.isShared(infile):
+        return _readShared(infile, window, out)
+    elif os.path.splitext(infile)[-1] == '.nc':
+        return _readNC(infile, dataset, window, out)
     else:
-        return _readTiff(infile)
+        return _readTiff(infile, window, out)
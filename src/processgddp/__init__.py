@@ -6,6 +6,7 @@ import logging
 from functools import partial
 from . import FileHandler
 from . import DependencyHandler
+from . import Worker
 from . import formulae
 
 formulae.registerFormulae()
@@ -28,22 +29,45 @@ OPTIONS = {
     'nocache':True,
     
     'cachedir':'_cache',    
+
+    # Process rasters in full-width tiles of this many rows to bound memory
+    #  use per task; 0 reads each input in full
+    'tilesize':0,
+
+    # Compute all indicators that read the same source file in a single task
+    'fuse':True,
+
+    # Publish intermediate arrays to a node-local store under cachedir so that
+    #  dependent tasks on the same node skip the S3 round trip; uploads to S3
+    #  continue in the background
+    'sharedstore':True,
+
     'verbose':False
 }
 
 def build(objs, skipExisting=True, options=OPTIONS, poolargs={}):
     '''executes the formulae for each key one at a time'''
     client = FileHandler.Client(**options)
-    tree = DependencyHandler.dependencyTree(objs, client, skipExisting, poolargs)
+    tree = DependencyHandler.dependencyTree(objs, client, skipExisting, poolargs,
+                                            options.get('fuse', False))
+    _releaseShared(tree, options)
     return tree.build(options=options)
 
 def build_async(objs, skipExisting=True, options=OPTIONS, poolargs={}):
     '''executes the formulae for each key in parallel'''
     client = FileHandler.Client(**options)
     client.cleanInvalidBucketObjs()
-    tree = DependencyHandler.dependencyTree(objs, client, skipExisting, poolargs)
+    tree = DependencyHandler.dependencyTree(objs, client, skipExisting, poolargs,
+                                            options.get('fuse', False))
+    _releaseShared(tree, options)
     return tree.build_async(options=options)
 
+def _releaseShared(tree, options):
+    '''remove shared intermediates once all tasks that consume them are complete'''
+    store = Worker.getStore(options)
+    if store is not None:
+        tree.on_release = store.remove
+
 def main(keys, options=OPTIONS):
     if options['verbose']:
         logging.basicConfig(level=logging.DEBUG)
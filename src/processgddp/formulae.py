@@ -42,17 +42,8 @@ def _maxruns(difs):
     else:
         return 0
 
-def maxRun2(arr):
-    shape = (1, *arr.shape[1:])
-    zeros = np.zeros(shape)
-    bounded = np.concatenate((zeros, arr, arr, zeros), axis=0)
-    difs = np.diff(bounded, axis=0)
-    out = np.empty(shape)
-    for i,j in np.ndindex(difs.shape[1:]):
-        out[0,i,j] = _maxruns(difs[:,i,j])
-    return out
-
-def maxRun(arr):
+def _maxRunPixelwise(arr):
+    '''reference per-pixel implementation of maxRun, used for benchmarking'''
     out = np.empty((1, *arr.shape[1:]))
     for i,j in np.ndindex(arr.shape[1:]):
         bounded = np.concatenate(([0], arr[:,i,j], arr[:,i,j], [0]))
@@ -60,7 +51,8 @@ def maxRun(arr):
         out[0,i,j] = _maxruns(difs)
     return out
 
-def _spells(arr, min_length):
+def _spellsPixelwise(arr, min_length):
+    '''reference per-pixel implementation of _spells, used for benchmarking'''
     out = np.empty((1, *arr.shape[1:]))
     for i,j in np.ndindex(arr.shape[1:]):
         bounded = np.concatenate(([0], arr[:,i,j], arr[:min_length,i,j], [0]))
@@ -74,6 +66,53 @@ def _spells(arr, min_length):
             out[0,i,j] = 0
     return out
 
+def maxRun(arr):
+    '''
+    Length of the longest run of True values along axis 0 for every pixel.
+
+    Runs wrap around from the end of the series to the start, so a pixel
+    that is True for every band has a run of twice the series length.
+    '''
+    arr = np.asarray(arr, dtype=bool)
+    n = arr.shape[0]
+    shape = arr.shape[1:]
+    run = np.zeros(shape, dtype=np.int32)
+    best = np.zeros(shape, dtype=np.int32)
+    for band in arr:
+        run += 1
+        run *= band
+        np.maximum(best, run, out=best)
+    # run now holds the trailing run; join it to the leading run
+    alltrue = run == n
+    lead = np.where(alltrue, n, np.argmin(arr, axis=0))
+    run += lead
+    np.maximum(best, run, out=best)
+    out = np.empty((1, *shape))
+    out[0] = best
+    return out
+
+def _spells(arr, min_length):
+    '''
+    Total length of runs of at least `min_length` True values along axis 0,
+    divided by `min_length`, for every pixel.
+
+    The first `min_length` bands are appended to the series so that runs
+    crossing the end of the series are counted.
+    '''
+    arr = np.asarray(arr, dtype=bool)
+    shape = arr.shape[1:]
+    run = np.zeros(shape, dtype=np.int32)
+    total = np.zeros(shape, dtype=np.int64)
+    for band in (*arr, *arr[:min_length]):
+        ended = ~band & (run >= min_length)
+        total += run * ended
+        run += 1
+        run *= band
+    total += run * (run >= min_length)
+    out = np.empty((1, *shape))
+    out[0] = total / min_length
+    return out
+
 def drydays(arr):
     return np.clip(maxRun(arr<mm2kgs(1)), 0, 365)
 def frostfree(arr):
@@ -194,3 +233,24 @@ def registerFormulae():
                 dh.registerFormula(dh.EnsembleFormula, f"{stat}-{series}", requires=series, function=stat)
             dh.registerFormula(dh.Formula2, f"iqr-{series}", requires=f"q75-{series}", function='sub',
                                requires2={'f': f'q25-{series}'})
+
+
+def benchmark(shape=(365, 90, 180), seed=0):
+    '''compare vectorized run-length kernels against the per-pixel loops'''
+    import time
+    rng = np.random.default_rng(seed)
+    arr = rng.random(shape) < .7
+    arr[:, 0, 0] = True
+    arr[:, 0, 1] = False
+    for name, fast, slow in (
+            ('maxRun', maxRun, _maxRunPixelwise),
+            ('spells', lambda a: _spells(a, 5), lambda a: _spellsPixelwise(a, 5))):
+        t = time.time()
+        expected = slow(arr)
+        t_slow = time.time() - t
+        t = time.time()
+        result = fast(arr)
+        t_fast = time.time() - t
+        assert np.array_equal(result, expected) and result.dtype == expected.dtype
+        print('{}: pixelwise {:.3f}s, vectorized {:.3f}s ({:.0f}x)'.format(
+            name, t_slow, t_fast, t_slow / t_fast))